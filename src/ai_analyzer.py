@@ -1,29 +1,143 @@
 """
 處理 AI 分析和程式碼審查建議生成的模組
 """
+import asyncio
+import functools
 import json
 import logging
+import math
 import os
+import re
 
 import httpx
+import orjson
+import tiktoken
+
+from src.response_cache import ResponseCache
+
+
+# 未在配置中指定時使用的上下文窗口大小（代幣數）
+DEFAULT_CONTEXT_WINDOW = 200000
+
+# 本地分詞器只是 Claude 分詞器的近似：cl100k_base 對程式碼和中日韓文字會低估 Claude 的代幣數，
+# 因此估算值按比例放大，並另外預留部分上下文窗口作為誤差緩衝
+TOKEN_ESTIMATE_RATIO = 1.3
+TOKEN_SAFETY_MARGIN = 0.1
+
+# Repomix XML 中 <file> 區塊的開始標籤（不匹配 <files>）
+_FILE_OPEN_RE = re.compile(r'<file[\s>]')
+
+# Repomix 不轉義文件內容，內容中可能出現 </file>；只有後面緊接下一個 <file path=" 或 </files> 的才是區塊的真正結尾
+_FILE_BOUNDARY_RE = re.compile(r'</file>(?=\s*(?:<file path="|</files>))')
+
+# ```json 區塊；貪婪匹配到最後一個 ```，以免建議內容中的程式碼區塊提前結束匹配
+_FENCE_RE = re.compile(r'```json\s*(.*)\s*```', re.DOTALL)
+
+# 遇到 429 或 5xx 時的最大嘗試次數，以及單次重試的最長等待時間（秒）
+MAX_RETRIES = 5
+MAX_RETRY_DELAY = 60
+
+# 總體評估的嚴重程度，合併多個審查結果時取最嚴重的一個
+ASSESSMENT_SEVERITY = {"良好": 0, "需要改進": 1, "有重大問題": 2}
+UNKNOWN_ASSESSMENT_SEVERITY = 0.5
+
+XML_PREFIX = "以下是程式碼的 XML 表示："
+
+# 按審查重點分別請求時，每個請求只報告自己負責的方面，避免各請求重複同一份完整審查
+EXCLUSIVE_FOCUS_INSTRUCTION = "本次審查只負責「{focus}」方面：summary 只總結此方面，suggestions 只列出屬於此方面的問題；其他方面的問題由其他審查負責，請不要列出。"
+
+# 靜態的審查指令和輸出格式，作為系統提示詞以便被提示詞快取重用
+STATIC_INSTRUCTIONS = """你是一位專業的程式碼審查專家。請審查以下程式碼並提供建議。
+
+請以以下 JSON 格式提供你的審查結果：
+
+```json
+{
+  "summary": "對 PR 的簡要總結，最多 3-5 句話",
+  "overall_assessment": "良好 | 需要改進 | 有重大問題",
+  "suggestions": [
+    {
+      "file": "檔案路徑",
+      "line": "行號或行範圍（如果適用）",
+      "severity": "critical | high | medium | low | praise",
+      "category": "架構 | 安全性 | 性能 | 可維護性 | 代碼風格 | 其他",
+      "description": "對問題的詳細描述",
+      "suggestion": "如何改進的建議"
+    }
+  ]
+}
+```
+
+請只返回 JSON 格式的結果，不要添加其他解釋或前言。"""
+
+
+@functools.lru_cache(maxsize=None)
+def _load_encoding():
+    """
+    加載 cl100k_base 分詞器，作為 Claude 分詞器的本地近似
+
+    首次加載需要下載 BPE 文件，結果在模組層級快取；無法加載時返回 None，改用字元數估算。
+
+    Returns:
+        tiktoken.Encoding: 分詞器，無法加載時為 None
+    """
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"無法加載 tiktoken 分詞器，改用字元數估算代幣數: {e}")
+        return None
 
 
 class AIAnalyzer:
 
-    def __init__(self, api_key=None, model="claude-3-haiku-20240307"):
+    def __init__(self, api_key=None, model="claude-3-haiku-20240307", max_tokens=4000, context_window=DEFAULT_CONTEXT_WINDOW, cache_ttl_hours=24):
         """
         初始化 AIAnalyzer
 
         Args:
             api_key (str, optional): AI API 密鑰，默認從環境變量獲取
             model (str, optional): 要使用的 AI 模型
+            max_tokens (int, optional): AI 回應的最大代幣數
+            context_window (int, optional): 模型的上下文窗口大小（代幣數）
+            cache_ttl_hours (float, optional): 回應快取有效時間（小時），0 表示停用快取
         """
         self.api_key = api_key or os.environ.get("AI_API_KEY")
         if not self.api_key:
             raise ValueError("未提供 AI API 密鑰")
 
         self.model = model
+        self.max_tokens = max_tokens
+        self.context_window = context_window
         self.logger = logging.getLogger(__name__)
+        self.cache = ResponseCache(ttl_hours=cache_ttl_hours)
+
+        # 建立持久的 HTTP 客戶端，重用連線以避免每次請求都重新握手
+        self._client = httpx.AsyncClient(timeout=120,
+                                         http2=True,
+                                         limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+                                         headers={
+                                             "x-api-key": self.api_key,
+                                             "anthropic-version": "2023-06-01",
+                                             "content-type": "application/json"
+                                         })
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        """
+        關閉 HTTP 客戶端並釋放連線
+        """
+        await self._client.aclose()
+
+    async def load_tokenizer(self):
+        """
+        在工作線程中預先加載分詞器，以便與其他耗時操作（如生成 XML）並行
+        """
+        await asyncio.to_thread(_load_encoding)
 
     async def analyze_code(self, xml_content, focus_areas=None, repo_name=None, pr_title=None, pr_description=None):
         """
@@ -36,53 +150,113 @@ class AIAnalyzer:
             pr_title (str, optional): PR 標題
             pr_description (str, optional): PR 描述
 
+        Returns:
+            dict: 包含審查建議的字典
+        """
+        # 分詞器加載和 XML 代幣計算較耗時，放到工作線程中執行以免阻塞事件循環
+        dynamic_context = self._build_context(focus_areas, repo_name, pr_title, pr_description)
+        trimmed_xml = await asyncio.to_thread(self._fit_xml_to_context, xml_content, dynamic_context)
+
+        return await self._analyze_trimmed(trimmed_xml, dynamic_context)
+
+    async def _analyze_trimmed(self, trimmed_xml, dynamic_context=""):
+        """
+        使用已裁剪的 XML 調用 AI 分析程式碼
+
+        Args:
+            trimmed_xml (str): 已裁剪到代幣預算內的 XML 內容
+            dynamic_context (str, optional): PR 動態資訊
+
         Returns:
             dict: 包含審查建議的字典
         """
         try:
             # 構建提示詞
-            prompt = self._build_prompt(xml_content, focus_areas, repo_name, pr_title, pr_description)
+            system_blocks, user_blocks = self._build_prompt(trimmed_xml, dynamic_context)
+
+            # 相同的模型和提示詞直接使用快取的回應；XML 區塊逐字參與計算，其餘部分正規化空白
+            xml_block = user_blocks[1]
+            prompt_blocks = [system_blocks, [block for block in user_blocks if block is not xml_block]]
+            cache_key = self.cache.make_key(self.model, orjson.dumps(prompt_blocks, option=orjson.OPT_SORT_KEYS).decode(), content=xml_block["text"])
+            ai_response = self.cache.get(cache_key)
+            if ai_response is not None:
+                self.logger.info("命中回應快取，跳過 AI API 調用")
+                return self._parse_ai_response(ai_response)
 
             # 調用 AI API
             self.logger.info("正在調用 AI API 進行程式碼分析")
 
             # 假設我們使用 Anthropic's Claude API
-            async with httpx.AsyncClient(timeout=120) as client:
-                response = await client.post("https://api.anthropic.com/v1/messages",
-                                             headers={
-                                                 "x-api-key": self.api_key,
-                                                 "anthropic-version": "2023-06-01",
-                                                 "content-type": "application/json"
-                                             },
-                                             json={
-                                                 "model": self.model,
-                                                 "max_tokens": 4000,
-                                                 "messages": [{
-                                                     "role": "user",
-                                                     "content": prompt
-                                                 }],
-                                                 "temperature": 0.3
-                                             })
-
-                if response.status_code != 200:
-                    self.logger.error(f"AI API 調用失敗: {response.status_code} {response.text}")
-                    raise Exception(f"AI API 調用失敗: {response.status_code}")
-
-                result = response.json()
-                ai_response = result["content"][0]["text"]
-
-                # 解析 AI 回應並結構化為審查建議
-                review_suggestions = self._parse_ai_response(ai_response)
-
-                return review_suggestions
+            response = await self._post_with_retry(orjson.dumps({
+                "model": self.model,
+                "max_tokens": self.max_tokens,
+                "system": system_blocks,
+                "messages": [{
+                    "role": "user",
+                    "content": user_blocks
+                }],
+                "temperature": 0.3
+            }))
+
+            if response.status_code != 200:
+                self.logger.error(f"AI API 調用失敗: {response.status_code} {response.text}")
+                raise Exception(f"AI API 調用失敗: {response.status_code}")
+
+            result = orjson.loads(response.content)
+            ai_response = result["content"][0]["text"]
+
+            # 解析 AI 回應並結構化為審查建議
+            review_suggestions = self._parse_ai_response(ai_response)
+
+            # 只快取完整且可解析的回應；因 max_tokens 被截斷或無法解析的回應下次應重新請求
+            if result.get("stop_reason") != "end_turn":
+                self.logger.warning(f"AI 回應未正常結束 (stop_reason: {result.get('stop_reason')})，不寫入快取")
+            elif "raw_response" not in review_suggestions:
+                self.cache.put(cache_key, ai_response)
+
+            return review_suggestions
 
         except Exception as e:
             self.logger.error(f"程式碼分析時出錯: {e}")
             raise
 
-    def _build_prompt(self, xml_content, focus_areas=None, repo_name=None, pr_title=None, pr_description=None):
+    async def _post_with_retry(self, content):
         """
-        構建 AI 提示詞
+        發送 AI API 請求，遇到速率限制或服務端錯誤時以指數退避重試
+
+        Args:
+            content (bytes): 請求內容
+
+        Returns:
+            httpx.Response: 最後一次請求的回應
+        """
+        for attempt in range(MAX_RETRIES):
+            response = await self._client.post("https://api.anthropic.com/v1/messages", content=content)
+
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+
+            if attempt == MAX_RETRIES - 1:
+                break
+
+            # 優先使用 retry-after 標頭指示的等待時間
+            try:
+                delay = float(response.headers.get("retry-after", 2**attempt))
+            except ValueError:
+                delay = 2**attempt
+            delay = min(delay, MAX_RETRY_DELAY)
+
+            self.logger.warning(f"AI API 返回 {response.status_code}，{delay} 秒後重試（第 {attempt + 1} 次）")
+            await asyncio.sleep(delay)
+
+        return response
+
+    async def analyze_code_by_focus(self, xml_content, focus_areas=None, repo_name=None, pr_title=None, pr_description=None):
+        """
+        按審查重點分別調用 AI 分析程式碼，再合併審查建議
+
+        每個請求只關注一個重點，XML 內容作為共同前綴。提示詞快取要在第一個回應開始後才能讀取，
+        所以先單獨完成第一個重點的請求寫入快取，其餘重點再並行請求並命中快取。
 
         Args:
             xml_content (str): 程式碼的 XML 表示
@@ -92,59 +266,243 @@ class AIAnalyzer:
             pr_description (str, optional): PR 描述
 
         Returns:
-            str: AI 提示詞
+            dict: 合併後的審查建議
         """
-        # 限制 XML 內容長度以避免超出上下文窗口
-        max_xml_length = 100000  # 這個值可能需要根據使用的 AI 模型調整
-        truncated_xml = xml_content[:max_xml_length] if len(xml_content) > max_xml_length else xml_content
+        if not focus_areas or len(focus_areas) == 1:
+            return await self.analyze_code(xml_content, focus_areas, repo_name, pr_title, pr_description)
+
+        contexts = [self._build_context([focus], repo_name, pr_title, pr_description, exclusive_focus=True) for focus in focus_areas]
+
+        # XML 只裁剪一次，以最長的動態資訊計算預算，確保所有請求共用同一個前綴
+        trimmed_xml = await asyncio.to_thread(self._fit_xml_to_context, xml_content, max(contexts, key=len))
 
-        prompt_parts = []
+        self.logger.info(f"按 {len(focus_areas)} 個審查重點分析程式碼")
+        first_result = await self._analyze_trimmed(trimmed_xml, contexts[0])
+        other_results = await asyncio.gather(*(self._analyze_trimmed(trimmed_xml, context) for context in contexts[1:]))
 
-        # 添加基本指令
-        prompt_parts.append("你是一位專業的程式碼審查專家。請審查以下程式碼並提供建議。")
+        return self._merge_suggestions(focus_areas, [first_result, *other_results])
+
+    def _merge_suggestions(self, focus_areas, results):
+        """
+        合併多個審查結果
 
+        Args:
+            focus_areas (list): 審查重點領域列表，與 results 一一對應
+            results (list): 各審查重點的審查建議
+
+        Returns:
+            dict: 合併後的審查建議；任一重點的回應無法解析時包含 raw_response
+        """
+        summaries = []
+        suggestions = []
+        seen_suggestions = set()
+        raw_responses = []
+        overall_assessment = None
+
+        for focus, result in zip(focus_areas, results):
+            summaries.append(f"**{focus}**: {result.get('summary', '無總結')}")
+
+            # 不同重點可能指出同一個問題，以文件、行號和描述去重
+            for suggestion in result.get("suggestions", []):
+                if isinstance(suggestion, dict):
+                    key = (suggestion.get("file"), str(suggestion.get("line")), suggestion.get("description"))
+                    if key in seen_suggestions:
+                        continue
+                    seen_suggestions.add(key)
+                suggestions.append(suggestion)
+
+            # 保留無法解析的原始回應，讓調用方可以識別部分失敗（例如不寫入快取）
+            if "raw_response" in result:
+                raw_responses.append(f"[{focus}]\n{result['raw_response']}")
+
+            # 取最嚴重的總體評估；無法識別的評估排在「良好」之上，避免部分失敗被正常結果掩蓋
+            assessment = result.get("overall_assessment") or "無法確定"
+            if overall_assessment is None or ASSESSMENT_SEVERITY.get(assessment, UNKNOWN_ASSESSMENT_SEVERITY) > ASSESSMENT_SEVERITY.get(overall_assessment, UNKNOWN_ASSESSMENT_SEVERITY):
+                overall_assessment = assessment
+
+        merged = {"summary": "\n\n".join(summaries), "overall_assessment": overall_assessment, "suggestions": suggestions}
+        if raw_responses:
+            merged["raw_response"] = "\n\n".join(raw_responses)
+
+        return merged
+
+    def _build_context(self, focus_areas=None, repo_name=None, pr_title=None, pr_description=None, exclusive_focus=False):
+        """
+        構建提示詞中的 PR 動態資訊
+
+        Args:
+            focus_areas (list, optional): 審查重點領域列表
+            repo_name (str, optional): 程式庫名稱
+            pr_title (str, optional): PR 標題
+            pr_description (str, optional): PR 描述
+            exclusive_focus (bool, optional): 是否只審查 focus_areas 中的方面，不做完整審查
+
+        Returns:
+            str: 動態資訊文字
+        """
         # 添加程式庫和 PR 資訊
+        context_parts = []
         if repo_name:
-            prompt_parts.append(f"程式庫：{repo_name}")
+            context_parts.append(f"程式庫：{repo_name}")
         if pr_title:
-            prompt_parts.append(f"PR 標題：{pr_title}")
+            context_parts.append(f"PR 標題：{pr_title}")
         if pr_description:
-            prompt_parts.append(f"PR 描述：{pr_description}")
+            context_parts.append(f"PR 描述：{pr_description}")
 
         # 添加審查重點
         if focus_areas:
             focus_str = "、".join(focus_areas)
-            prompt_parts.append(f"請特別關注以下方面：{focus_str}")
+            if exclusive_focus:
+                context_parts.append(EXCLUSIVE_FOCUS_INSTRUCTION.format(focus=focus_str))
+            else:
+                context_parts.append(f"請特別關注以下方面：{focus_str}")
 
-        # 添加輸出格式指令
-        prompt_parts.append("""
-請以以下 JSON 格式提供你的審查結果：
+        return "\n\n".join(context_parts)
 
-```json
-{
-  "summary": "對 PR 的簡要總結，最多 3-5 句話",
-  "overall_assessment": "良好 | 需要改進 | 有重大問題",
-  "suggestions": [
-    {
-      "file": "檔案路徑",
-      "line": "行號或行範圍（如果適用）",
-      "severity": "critical | high | medium | low | praise",
-      "category": "架構 | 安全性 | 性能 | 可維護性 | 代碼風格 | 其他",
-      "description": "對問題的詳細描述",
-      "suggestion": "如何改進的建議"
-    }
-  ]
-}
-```
+    def _build_prompt(self, xml_content, dynamic_context=""):
+        """
+        構建 AI 提示詞
 
-請只返回 JSON 格式的結果，不要添加其他解釋或前言。
-        """)
+        靜態的指令和 XML 內容放在前面並標記 cache_control，讓 Anthropic 的提示詞快取可以重用；
+        PR 相關的動態資訊放在最後。
 
-        # 添加程式碼的 XML 表示
-        prompt_parts.append("以下是程式碼的 XML 表示：")
-        prompt_parts.append(truncated_xml)
+        Args:
+            xml_content (str): 已裁剪到代幣預算內的 XML 內容
+            dynamic_context (str, optional): PR 動態資訊
 
-        return "\n\n".join(prompt_parts)
+        Returns:
+            tuple: (system_blocks, user_blocks) 兩個內容區塊列表
+        """
+        # 基本指令和輸出格式（靜態，可快取）
+        system_blocks = [{"type": "text", "text": STATIC_INSTRUCTIONS, "cache_control": {"type": "ephemeral"}}]
+
+        # 添加程式碼的 XML 表示（可快取），XML 單獨作為一個區塊以免與其他文字拼接複製；動態資訊放在最後以保持前綴一致
+        user_blocks = [{"type": "text", "text": XML_PREFIX}, {"type": "text", "text": xml_content, "cache_control": {"type": "ephemeral"}}]
+        if dynamic_context:
+            user_blocks.append({"type": "text", "text": dynamic_context})
+
+        return system_blocks, user_blocks
+
+    def _fit_xml_to_context(self, xml_content, dynamic_context=""):
+        """
+        根據模型上下文窗口扣除其他部分和回應長度，將 XML 裁剪到可用的代幣預算內
+
+        Args:
+            xml_content (str): 程式碼的 XML 表示
+            dynamic_context (str, optional): PR 動態資訊
+
+        Returns:
+            str: 裁剪後的 XML 內容
+        """
+        static_tokens = self._count_tokens(STATIC_INSTRUCTIONS) + self._count_tokens(XML_PREFIX) + self._count_tokens(dynamic_context)
+        xml_budget = int(self.context_window * (1 - TOKEN_SAFETY_MARGIN)) - static_tokens - self.max_tokens
+        return self._trim_xml_to_budget(xml_content, xml_budget)
+
+    def _count_tokens(self, text):
+        """
+        估算文字在 Claude 中的代幣數
+
+        Args:
+            text (str): 要估算的文字
+
+        Returns:
+            int: 代幣數
+        """
+        encoding = _load_encoding()
+        if encoding is None:
+            # 沒有分詞器時以字元數作為保守估計
+            return len(text)
+
+        return math.ceil(len(encoding.encode(text, disallowed_special=())) * TOKEN_ESTIMATE_RATIO)
+
+    def _truncate_to_tokens(self, text, budget):
+        """
+        將文字直接截斷到代幣預算內
+
+        Args:
+            text (str): 要截斷的文字
+            budget (int): 可用的代幣數
+
+        Returns:
+            str: 截斷後的文字
+        """
+        budget = max(budget, 0)
+        encoding = _load_encoding()
+        if encoding is None:
+            return text[:budget]
+
+        tokens = encoding.encode(text, disallowed_special=())
+        return encoding.decode(tokens[:int(budget / TOKEN_ESTIMATE_RATIO)])
+
+    def _trim_xml_to_budget(self, xml_content, budget):
+        """
+        以完整的 <file> 區塊為單位裁剪 XML，使其不超過代幣預算
+
+        Repomix 的頭部（文件摘要、目錄結構和 <files> 開始標籤）和結尾總是保留；
+        當頭部和結尾本身就超出預算，或 XML 中沒有 <file> 區塊時，退回直接截斷。
+
+        Args:
+            xml_content (str): 程式碼的 XML 表示
+            budget (int): 可用的代幣數
+
+        Returns:
+            str: 裁剪後的 XML 內容
+        """
+        first_open = _FILE_OPEN_RE.search(xml_content)
+        block_ends = [match.end() for match in _FILE_BOUNDARY_RE.finditer(xml_content, first_open.start())] if first_open else []
+
+        if not block_ends:
+            if self._count_tokens(xml_content) <= budget:
+                return xml_content
+
+            self.logger.warning(f"XML 內容中沒有可拆分的文件區塊且超出代幣預算 ({budget})，已直接截斷")
+            return self._truncate_to_tokens(xml_content, budget)
+
+        # 拆出頭部、各 <file> 區塊和結尾（</files> 等），確保不會送出被截斷的標籤
+        body_start = first_open.start()
+        header = xml_content[:body_start]
+        tail = xml_content[block_ends[-1]:]
+        blocks = [xml_content[start:end] for start, end in zip([body_start, *block_ends], block_ends)]
+
+        used = self._count_tokens(header) + self._count_tokens(tail)
+        if used > budget:
+            self.logger.warning(f"XML 頭部和結尾已超出代幣預算 ({budget})，已直接截斷")
+            return self._truncate_to_tokens(xml_content, budget)
+
+        kept = [header]
+        skipped = 0
+        for block in blocks:
+            block_tokens = self._count_tokens(block)
+            if used + block_tokens > budget:
+                skipped += 1
+                continue
+            kept.append(block)
+            used += block_tokens
+
+        # 全部內容都在預算內時直接返回原字串，避免重新拼接
+        if not skipped:
+            return xml_content
+
+        self.logger.warning(f"XML 內容超出代幣預算 ({budget})，已略過 {skipped} 個文件區塊")
+
+        kept.append(tail)
+        return "".join(kept)
+
+    def _loads_json(self, content):
+        """
+        解析 JSON 字串
+
+        Args:
+            content (str): JSON 字串
+
+        Returns:
+            解析後的 Python 對象
+        """
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            # orjson 不接受 NaN 等非標準 JSON，退回標準庫解析
+            return json.loads(content)
 
     def _parse_ai_response(self, ai_response):
         """
@@ -158,20 +516,23 @@ class AIAnalyzer:
         """
         try:
             # 嘗試提取 JSON 部分
-            json_start = ai_response.find('```json')
-            json_end = ai_response.rfind('```')
-
-            if json_start != -1 and json_end != -1:
-                json_start += 7  # 跳過 ```json
-                json_content = ai_response[json_start:json_end].strip()
-                return json.loads(json_content)
-
-            # 如果沒有 JSON 格式，嘗試直接解析整個回應
-            try:
-                return json.loads(ai_response)
-            except:
-                # 如果無法解析為 JSON，則返回原始回應
-                return {"summary": "無法解析 AI 回應為 JSON 格式", "overall_assessment": "無法確定", "raw_response": ai_response}
+            fence_match = _FENCE_RE.search(ai_response)
+
+            if fence_match:
+                review_suggestions = self._loads_json(fence_match.group(1))
+            else:
+                # 如果沒有 JSON 格式，嘗試直接解析整個回應
+                try:
+                    review_suggestions = self._loads_json(ai_response)
+                except:
+                    # 如果無法解析為 JSON，則返回原始回應
+                    return {"summary": "無法解析 AI 回應為 JSON 格式", "overall_assessment": "無法確定", "raw_response": ai_response}
+
+            # 合法但不是物件的 JSON（如列表）同樣視為無法解析
+            if not isinstance(review_suggestions, dict):
+                return {"summary": "AI 回應不是 JSON 物件", "overall_assessment": "無法確定", "raw_response": ai_response}
+
+            return review_suggestions
 
         except Exception as e:
             self.logger.error(f"解析 AI 回應時出錯: {e}")
@@ -1,12 +1,54 @@
 """
 處理配置和用戶偏好的模組
 """
+import copy
 import logging
 import os
 import re
 
 import yaml
 
+# 優先使用 libyaml 的 C 實現，未安裝時退回純 Python 實現
+try:
+    from yaml import CSafeDumper as SafeDumper
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
+
+# 類似 "AI-REVIEW-FOCUS: #security #performance" 的標記
+_FOCUS_RE = re.compile(r'AI-REVIEW-FOCUS:\s*(.*?)(?:\n|$)')
+_TAG_RE = re.compile(r'#(\w+)')
+
+# 示例配置文件的內容
+_EXAMPLE_CONFIG = {
+    'review_focus': [
+        'code_quality',  # 代碼質量
+        'architecture',  # 架構一致性
+        'security',  # 安全性
+        'performance',  # 性能
+        'maintainability',  # 可維護性
+        'best_practices'  # 最佳實踐
+    ],
+    'ai': {
+        'model': 'claude-3-haiku-20240307',  # AI 模型
+        'max_tokens': 4000,  # 最大代幣數
+        'context_window': 200000,  # 模型的上下文窗口大小（代幣數）
+        'cache_ttl_hours': 24,  # 回應快取有效時間（小時），0 為停用
+        'parallel_focus': True  # 是否按審查重點並行調用 AI
+    },
+    'github': {
+        # 評論類型：'issue' 為普通評論，'review' 為正式審查
+        'comment_type': 'issue',
+        # 評論放置：'pr' 為 PR 級別，'line' 為行級別
+        'comment_placement': 'pr'
+    },
+    'repomix': {
+        'style': 'xml',  # 輸出格式
+        'include_patterns': None,  # 包含模式
+        'exclude_patterns': None  # 排除模式
+    }
+}
+
 
 class ConfigManager:
 
@@ -21,6 +63,11 @@ class ConfigManager:
         self.logger = logging.getLogger(__name__)
         self.config = self._load_config()
 
+        # 緩存各部分配置，避免每次調用時重新查找
+        self._ai_config = self.config.get('ai', {})
+        self._github_config = self.config.get('github', {})
+        self._repomix_config = self.config.get('repomix', {})
+
     def _load_config(self):
         """
         加載配置文件
@@ -32,7 +79,10 @@ class ConfigManager:
             'review_focus': ['code_quality', 'architecture', 'security', 'performance', 'maintainability'],
             'ai': {
                 'model': 'claude-3-haiku-20240307',
-                'max_tokens': 4000
+                'max_tokens': 4000,
+                'context_window': 200000,
+                'cache_ttl_hours': 24,
+                'parallel_focus': True
             },
             'github': {
                 'comment_type': 'issue',  # 'issue' 或 'review'
@@ -49,7 +99,7 @@ class ConfigManager:
         if os.path.exists(self.config_path):
             try:
                 with open(self.config_path, 'r', encoding='utf-8') as file:
-                    user_config = yaml.safe_load(file)
+                    user_config = yaml.load(file, Loader=SafeLoader)
 
                     # 合併默認配置和用戶配置
                     if user_config:
@@ -68,7 +118,7 @@ class ConfigManager:
 
     def _merge_configs(self, default_config, user_config):
         """
-        遞歸合併配置
+        深度合併配置
 
         Args:
             default_config (dict): 默認配置
@@ -77,13 +127,17 @@ class ConfigManager:
         Returns:
             dict: 合併後的配置
         """
-        config = default_config.copy()
+        # 只在開始時複製一次默認配置，之後以工作堆疊原地合併各層字典
+        config = copy.deepcopy(default_config)
+        stack = [(config, user_config)]
 
-        for key, value in user_config.items():
-            if key in config and isinstance(config[key], dict) and isinstance(value, dict):
-                config[key] = self._merge_configs(config[key], value)
-            else:
-                config[key] = value
+        while stack:
+            target, source = stack.pop()
+            for key, value in source.items():
+                if isinstance(value, dict) and isinstance(target.get(key), dict):
+                    stack.append((target[key], value))
+                else:
+                    target[key] = value
 
         return config
 
@@ -101,12 +155,12 @@ class ConfigManager:
             return []
 
         # 查找類似 "AI-REVIEW-FOCUS: #security #performance" 的標記
-        focus_match = re.search(r'AI-REVIEW-FOCUS:\s*(.*?)(?:\n|$)', pr_description)
+        focus_match = _FOCUS_RE.search(pr_description)
 
         if focus_match:
             focus_text = focus_match.group(1).strip()
             # 提取所有 #tag 格式的標籤
-            tags = re.findall(r'#(\w+)', focus_text)
+            tags = _TAG_RE.findall(focus_text)
             return tags
 
         return []
@@ -137,7 +191,7 @@ class ConfigManager:
         Returns:
             dict: AI 配置字典
         """
-        return self.config.get('ai', {})
+        return self._ai_config
 
     def get_github_config(self):
         """
@@ -146,7 +200,7 @@ class ConfigManager:
         Returns:
             dict: GitHub 配置字典
         """
-        return self.config.get('github', {})
+        return self._github_config
 
     def get_repomix_config(self):
         """
@@ -155,7 +209,7 @@ class ConfigManager:
         Returns:
             dict: Repomix 配置字典
         """
-        return self.config.get('repomix', {})
+        return self._repomix_config
 
     def create_example_config(self, output_path='.ai-review.yml.example'):
         """
@@ -167,35 +221,9 @@ class ConfigManager:
         Returns:
             str: 創建的配置文件的路徑
         """
-        example_config = {
-            'review_focus': [
-                'code_quality',  # 代碼質量
-                'architecture',  # 架構一致性
-                'security',  # 安全性
-                'performance',  # 性能
-                'maintainability',  # 可維護性
-                'best_practices'  # 最佳實踐
-            ],
-            'ai': {
-                'model': 'claude-3-haiku-20240307',  # AI 模型
-                'max_tokens': 4000  # 最大代幣數
-            },
-            'github': {
-                # 評論類型：'issue' 為普通評論，'review' 為正式審查
-                'comment_type': 'issue',
-                # 評論放置：'pr' 為 PR 級別，'line' 為行級別
-                'comment_placement': 'pr'
-            },
-            'repomix': {
-                'style': 'xml',  # 輸出格式
-                'include_patterns': None,  # 包含模式
-                'exclude_patterns': None  # 排除模式
-            }
-        }
-
         try:
             with open(output_path, 'w', encoding='utf-8') as file:
-                yaml.dump(example_config, file, default_flow_style=False, allow_unicode=True)
+                yaml.dump(_EXAMPLE_CONFIG, file, Dumper=SafeDumper, default_flow_style=False, allow_unicode=True)
 
             self.logger.info(f"已創建示例配置文件: {output_path}")
             return output_path
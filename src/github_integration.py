@@ -1,12 +1,122 @@
 """
 處理 GitHub 整合和 PR 評論發布的模組
 """
-import json
+import asyncio
 import logging
 import os
+from collections import defaultdict
 
-from github import Github
-from github.GithubException import GithubException
+import httpx
+
+
+# 以單個 GraphQL 變更創建帶行級評論的審查，只返回需要的欄位
+ADD_REVIEW_MUTATION = """
+mutation($input: AddPullRequestReviewInput!) {
+  addPullRequestReview(input: $input) {
+    pullRequestReview {
+      id
+      url
+    }
+  }
+}
+"""
+
+
+class AsyncGitHubClient:
+
+    def __init__(self, token, max_concurrency=5):
+        """
+        初始化 AsyncGitHubClient
+
+        Args:
+            token (str): GitHub 訪問令牌
+            max_concurrency (int, optional): 同時進行的請求上限，避免觸發速率限制
+        """
+        self.logger = logging.getLogger(__name__)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        # 建立持久的 HTTP 客戶端，重用連線以避免每次請求都重新握手
+        self._client = httpx.AsyncClient(base_url="https://api.github.com",
+                                         timeout=30,
+                                         http2=True,
+                                         limits=httpx.Limits(max_keepalive_connections=10),
+                                         headers={
+                                             "Authorization": f"Bearer {token}",
+                                             "Accept": "application/vnd.github+json",
+                                             "X-GitHub-Api-Version": "2022-11-28"
+                                         })
+
+    async def aclose(self):
+        """
+        關閉 HTTP 客戶端並釋放連線
+        """
+        await self._client.aclose()
+
+    async def request(self, method, url, **kwargs):
+        """
+        發送 GitHub API 請求
+
+        Args:
+            method (str): HTTP 方法
+            url (str): 相對於 API 根路徑的 URL 或完整 URL
+            **kwargs: 傳給 httpx 的其他參數
+
+        Returns:
+            httpx.Response: API 回應
+        """
+        async with self._semaphore:
+            response = await self._client.request(method, url, **kwargs)
+
+        if response.status_code >= 400:
+            self.logger.error(f"GitHub API 調用失敗: {method} {url} {response.status_code} {response.text}")
+            raise Exception(f"GitHub API 調用失敗: {response.status_code}")
+
+        return response
+
+    async def graphql(self, query, variables=None):
+        """
+        發送 GitHub GraphQL 請求
+
+        Args:
+            query (str): GraphQL 查詢或變更
+            variables (dict, optional): 查詢變數
+
+        Returns:
+            dict: 回應中的 data 部分
+        """
+        response = await self.request("POST", "/graphql", json={"query": query, "variables": variables or {}})
+        result = response.json()
+
+        # GraphQL 的錯誤以 200 狀態碼返回，需要另外檢查
+        if result.get("errors"):
+            self.logger.error(f"GitHub GraphQL 調用失敗: {result['errors']}")
+            raise Exception(f"GitHub GraphQL 調用失敗: {result['errors'][0].get('message')}")
+
+        return result["data"]
+
+    async def paginate(self, url, params=None):
+        """
+        依照 Link 標頭獲取所有分頁的結果
+
+        Args:
+            url (str): 第一頁的 URL
+            params (dict, optional): 查詢參數
+
+        Returns:
+            list: 所有分頁結果合併後的列表
+        """
+        items = []
+        params = {"per_page": 100, **(params or {})}
+
+        while url:
+            response = await self.request("GET", url, params=params)
+            items.extend(response.json())
+
+            # 下一頁的 URL 已包含查詢參數
+            url = response.links.get("next", {}).get("url")
+            params = None
+
+        return items
 
 
 class GitHubIntegration:
@@ -23,18 +133,21 @@ class GitHubIntegration:
         if not self.token:
             raise ValueError("未提供 GitHub 訪問令牌")
 
-        self.github = Github(self.token)
+        self.client = AsyncGitHubClient(self.token)
         self.repo_name = repo_name
         self.logger = logging.getLogger(__name__)
 
-        # 如果提供了 repo_name，則獲取程式庫對象
-        self.repo = None
-        if self.repo_name:
-            try:
-                self.repo = self.github.get_repo(self.repo_name)
-            except GithubException as e:
-                self.logger.error(f"獲取程式庫時出錯: {e}")
-                raise
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        """
+        關閉 GitHub 客戶端並釋放連線
+        """
+        await self.client.aclose()
 
     def set_repo(self, repo_name):
         """
@@ -43,33 +156,41 @@ class GitHubIntegration:
         Args:
             repo_name (str): 程式庫名稱（格式：'owner/repo'）
         """
-        try:
-            self.repo_name = repo_name
-            self.repo = self.github.get_repo(repo_name)
-        except GithubException as e:
-            self.logger.error(f"設置程式庫時出錯: {e}")
-            raise
+        self.repo_name = repo_name
 
-    def get_pr(self, pr_number):
+    def _repo_url(self, path):
         """
-        獲取 PR 對象
+        構建程式庫相關的 API 路徑
 
         Args:
-            pr_number (int): PR 編號
+            path (str): 程式庫下的子路徑
 
         Returns:
-            github.PullRequest.PullRequest: PR 對象
+            str: API 路徑
         """
-        if not self.repo:
+        if not self.repo_name:
             raise ValueError("未設置程式庫")
 
+        return f"/repos/{self.repo_name}/{path}"
+
+    async def get_pr(self, pr_number):
+        """
+        獲取 PR 信息
+
+        Args:
+            pr_number (int): PR 編號
+
+        Returns:
+            dict: GitHub API 返回的 PR 資料
+        """
         try:
-            return self.repo.get_pull(pr_number)
-        except GithubException as e:
+            response = await self.client.request("GET", self._repo_url(f"pulls/{pr_number}"))
+            return response.json()
+        except Exception as e:
             self.logger.error(f"獲取 PR 時出錯: {e}")
             raise
 
-    def get_pr_files(self, pr_number):
+    async def get_pr_files(self, pr_number):
         """
         獲取 PR 中更改的文件列表
 
@@ -80,13 +201,13 @@ class GitHubIntegration:
             list: 更改的文件路徑列表
         """
         try:
-            pr = self.get_pr(pr_number)
-            return [file.filename for file in pr.get_files()]
+            files = await self.client.paginate(self._repo_url(f"pulls/{pr_number}/files"))
+            return [file["filename"] for file in files]
         except Exception as e:
             self.logger.error(f"獲取 PR 文件時出錯: {e}")
             raise
 
-    def post_review_comment(self, pr_number, review_suggestions):
+    async def post_review_comment(self, pr_number, review_suggestions):
         """
         在 PR 上發布審查評論
 
@@ -95,64 +216,70 @@ class GitHubIntegration:
             review_suggestions (dict): 審查建議
 
         Returns:
-            github.IssueComment.IssueComment: 創建的評論對象
+            dict: GitHub API 返回的評論資料
         """
         try:
-            pr = self.get_pr(pr_number)
-
             # 格式化評論內容
             comment = self._format_review_comment(review_suggestions)
 
             # 發布評論
-            return pr.create_issue_comment(comment)
+            response = await self.client.request("POST", self._repo_url(f"issues/{pr_number}/comments"), json={"body": comment})
+            return response.json()
 
         except Exception as e:
             self.logger.error(f"發布評論時出錯: {e}")
             raise
 
-    def post_line_comments(self, pr_number, review_suggestions):
+    async def post_line_comments(self, pr_number, review_suggestions, pr_node_id=None):
         """
         在 PR 上發布行級評論
 
         Args:
             pr_number (int): PR 編號
             review_suggestions (dict): 審查建議
+            pr_node_id (str, optional): PR 的 GraphQL 節點 ID，未提供時從 API 獲取
 
         Returns:
-            github.PullRequestReview.PullRequestReview: 創建的審查對象
+            dict: 創建的審查的 id 和 url
         """
         try:
-            pr = self.get_pr(pr_number)
-
-            # 提取具體的檔案和行級建議
+            # 提取具體的檔案和行級建議，按 (文件, 行號) 分組以合併同一行的重複建議
             suggestions = review_suggestions.get("suggestions", [])
-            file_comments = []
+            buckets = defaultdict(list)
 
             for suggestion in suggestions:
                 # 僅處理包含文件和行信息的建議
-                if "file" in suggestion and "line" in suggestion:
-                    file_path = suggestion["file"]
-                    line_info = suggestion["line"]
-
-                    # 處理行號信息（可能是單行或範圍）
-                    line_number = None
-                    if isinstance(line_info, (int, str)) and str(line_info).isdigit():
-                        line_number = int(line_info)
-                    elif "-" in str(line_info):
-                        # 對於範圍，使用範圍的起始行
-                        line_parts = str(line_info).split("-")
-                        if line_parts[0].strip().isdigit():
-                            line_number = int(line_parts[0].strip())
-
-                    if line_number:
-                        # 格式化評論內容
-                        comment_body = f"**{suggestion.get('category', '評論')} ({suggestion.get('severity', '提示')})**\n\n"
-                        comment_body += suggestion.get('description', '')
-
-                        if suggestion.get('suggestion'):
-                            comment_body += f"\n\n**建議**: {suggestion['suggestion']}"
-
-                        file_comments.append({"path": file_path, "line": line_number, "body": comment_body})
+                file_path = suggestion.get("file")
+                line_info = suggestion.get("line")
+                if file_path is None or line_info is None:
+                    continue
+
+                # 處理行號信息（可能是單行或範圍）
+                line_str = str(line_info)
+                line_number = None
+                if isinstance(line_info, (int, str)) and line_str.isdigit():
+                    line_number = int(line_str)
+                elif "-" in line_str:
+                    # 對於範圍，使用範圍的起始行
+                    line_start = line_str.split("-", 1)[0].strip()
+                    if line_start.isdigit():
+                        line_number = int(line_start)
+
+                if line_number:
+                    # 格式化評論內容
+                    parts = [f"**{suggestion.get('category', '評論')} ({suggestion.get('severity', '提示')})**\n\n", suggestion.get('description', '')]
+
+                    advice = suggestion.get('suggestion')
+                    if advice:
+                        parts.append(f"\n\n**建議**: {advice}")
+
+                    comment_body = "".join(parts)
+                    bucket = buckets[(file_path, line_number)]
+                    if comment_body not in bucket:
+                        bucket.append(comment_body)
+
+            # 每個 (文件, 行號) 只發送一條評論，並按文件和行號排序
+            file_comments = [{"path": path, "line": line, "side": "RIGHT", "body": "\n\n---\n\n".join(bodies)} for (path, line), bodies in sorted(buckets.items())]
 
             # 如果有具體的行評論，則創建正式審查
             if file_comments:
@@ -160,11 +287,19 @@ class GitHubIntegration:
                 summary = f"# AI 程式碼審查\n\n**總體評估**: {review_suggestions.get('overall_assessment', '無評估')}\n\n"
                 summary += review_suggestions.get('summary', '無總結')
 
+                if not pr_node_id:
+                    pr_node_id = (await self.get_pr(pr_number))["node_id"]
+
                 # 創建審查
-                return pr.create_review(
-                    body=summary,
-                    event="COMMENT",  # 可以是 "APPROVE", "REQUEST_CHANGES" 或 "COMMENT"
-                    comments=file_comments)
+                data = await self.client.graphql(ADD_REVIEW_MUTATION, {
+                    "input": {
+                        "pullRequestId": pr_node_id,
+                        "body": summary,
+                        "event": "COMMENT",  # 可以是 "APPROVE", "REQUEST_CHANGES" 或 "COMMENT"
+                        "threads": file_comments
+                    }
+                })
+                return data["addPullRequestReview"]["pullRequestReview"]
 
             return None
 
@@ -3,23 +3,30 @@ AI 程式碼審查工具主程式
 """
 import argparse
 import asyncio
-import json
 import logging
 import os
 import re
 import sys
-import tempfile
+
+import orjson
 
 from src.ai_analyzer import AIAnalyzer
 from src.config_manager import ConfigManager
 from src.github_integration import GitHubIntegration
 from src.repomix_handler import RepomixHandler
+from src.response_cache import ResponseCache
 
 # 設置日誌
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', handlers=[logging.StreamHandler(sys.stdout)])
 
 logger = logging.getLogger(__name__)
 
+# GITHUB_REF 中的 PR 編號，格式如 'refs/pull/123/merge'
+_PR_REF_RE = re.compile(r'refs/pull/(\d+)/merge')
+
+# 按提交 SHA 快取審查結果的目錄
+REVIEW_CACHE_DIR = '.ai-review-cache'
+
 
 async def main():
     """主函數"""
@@ -32,6 +39,7 @@ async def main():
     parser.add_argument('--config', default='.ai-review.yml', help='配置文件路徑')
     parser.add_argument('--init', action='store_true', help='創建示例配置文件')
     parser.add_argument('--output', help='審查結果輸出路徑')
+    parser.add_argument('--no-cache', action='store_true', help='停用審查結果和 AI 回應快取')
 
     args = parser.parse_args()
 
@@ -64,7 +72,7 @@ async def main():
 
         # 解析 PR 編號 (從 GITHUB_REF，格式如 'refs/pull/123/merge')
         github_ref = os.environ.get('GITHUB_REF', '')
-        pr_match = re.search(r'refs/pull/(\d+)/merge', github_ref)
+        pr_match = _PR_REF_RE.search(github_ref)
         pr_number = int(pr_match.group(1)) if pr_match else None
 
         # 如果命令行參數未提供，則使用環境變量
@@ -85,60 +93,70 @@ async def main():
 
     try:
         # 初始化 GitHub 整合
-        github_integration = GitHubIntegration(github_token, args.repo)
-
-        # 獲取 PR 信息
-        logger.info(f"獲取 PR #{args.pr} 信息")
-        pr = github_integration.get_pr(args.pr)
-        pr_title = pr.title
-        pr_description = pr.body
-
-        # 獲取 PR 中更改的文件
-        logger.info("獲取 PR 中更改的文件")
-        pr_files = github_integration.get_pr_files(args.pr)
-
-        if not pr_files:
-            logger.warning("PR 中沒有找到更改的文件。退出程序。")
-            return
-
-        # 獲取審查重點
-        review_focus = config_manager.get_review_focus(pr_description)
-        logger.info(f"審查重點: {', '.join(review_focus)}")
-
-        # 初始化 Repomix 處理器
-        repomix_handler = RepomixHandler()
-
-        # 檢查 Repomix 是否已安裝
-        if not repomix_handler.check_repomix_installed():
-            logger.warning("Repomix 未安裝。將嘗試使用 npx 運行。")
-
-        # 獲取 Repomix 配置
-        repomix_config = config_manager.get_repomix_config()
-
-        # 為 PR 生成 XML
-        logger.info("使用 Repomix 生成 XML")
-        with tempfile.NamedTemporaryFile(suffix='.xml', delete=False) as temp_file:
-            xml_path = temp_file.name
-
-        try:
-            # 生成 XML
-            xml_path = repomix_handler.generate_xml_for_pr(pr_files, xml_path)
-
-            # 讀取 XML 內容
-            xml_content = repomix_handler.read_xml_content(xml_path)
-
-            # 初始化 AI 分析器
+        async with GitHubIntegration(github_token, args.repo) as github_integration:
+            # 並行獲取 PR 信息和更改的文件
+            logger.info(f"獲取 PR #{args.pr} 信息和更改的文件")
+            pr, pr_files = await asyncio.gather(
+                github_integration.get_pr(args.pr),
+                github_integration.get_pr_files(args.pr))
+            pr_title = pr.get('title')
+            pr_description = pr.get('body')
+
+            if not pr_files:
+                logger.warning("PR 中沒有找到更改的文件。退出程序。")
+                return
+
+            # 獲取審查重點
+            review_focus = config_manager.get_review_focus(pr_description)
+            logger.info(f"審查重點: {', '.join(review_focus)}")
+
+            # 同一提交、審查重點和 AI 設定的審查結果可直接重用，跳過 Repomix 和 AI 分析
             ai_config = config_manager.get_ai_config()
-            ai_analyzer = AIAnalyzer(ai_api_key, model=ai_config.get('model', 'claude-3-haiku-20240307'))
-
-            # 使用 AI 分析程式碼
-            logger.info("使用 AI 分析程式碼")
-            review_suggestions = await ai_analyzer.analyze_code(xml_content, focus_areas=review_focus, repo_name=args.repo, pr_title=pr_title, pr_description=pr_description)
+            model = ai_config.get('model', 'claude-3-haiku-20240307')
+            max_tokens = ai_config.get('max_tokens', 4000)
+            context_window = ai_config.get('context_window', 200000)
+            parallel_focus = ai_config.get('parallel_focus', True)
+            cache_ttl_hours = 0 if args.no_cache else ai_config.get('cache_ttl_hours', 24)
+            review_cache = ResponseCache(REVIEW_CACHE_DIR, ttl_hours=cache_ttl_hours)
+            # 所有會影響審查結果的設定都參與計算，修改設定後不會重用舊的審查結果
+            review_cache_key = review_cache.make_key(model, f"{args.repo}|{pr['head']['sha']}|{','.join(sorted(review_focus))}|parallel_focus={parallel_focus}|max_tokens={max_tokens}|context_window={context_window}")
+            review_suggestions = review_cache.get(review_cache_key)
+
+            if review_suggestions is not None:
+                logger.info("命中審查結果快取，跳過 Repomix 和 AI 分析")
+            else:
+                # 初始化 Repomix 處理器；直接通過 npx 運行，無需另外啟動一次 npx 檢查版本
+                repomix_handler = RepomixHandler()
+
+                # 獲取 Repomix 配置
+                repomix_config = config_manager.get_repomix_config()
+
+                # 在子進程中通過管道生成 XML，同時加載分詞器（冷啟動時需要下載 BPE 文件）
+                logger.info("使用 Repomix 生成 XML")
+                xml_task = asyncio.create_task(repomix_handler.generate_xml_for_pr(pr_files))
+
+                try:
+                    async with AIAnalyzer(ai_api_key, model=model, max_tokens=max_tokens, context_window=context_window, cache_ttl_hours=cache_ttl_hours) as ai_analyzer:
+                        xml_content, _ = await asyncio.gather(xml_task, ai_analyzer.load_tokenizer())
+
+                        # 使用 AI 分析程式碼
+                        logger.info("使用 AI 分析程式碼")
+                        analyze = ai_analyzer.analyze_code_by_focus if parallel_focus else ai_analyzer.analyze_code
+                        review_suggestions = await analyze(xml_content, focus_areas=review_focus, repo_name=args.repo, pr_title=pr_title, pr_description=pr_description)
+                finally:
+                    # AI 分析器初始化或分析失敗時取消仍在執行的 Repomix 任務，並等待其清理子進程
+                    if not xml_task.done():
+                        xml_task.cancel()
+                        await asyncio.gather(xml_task, return_exceptions=True)
+
+                # 無法解析的 AI 回應（包括多個審查重點中部分失敗的合併結果）不快取，以便下次重新審查
+                if "raw_response" not in review_suggestions:
+                    review_cache.put(review_cache_key, review_suggestions)
 
             # 如果指定了輸出路徑，則保存審查結果
             if args.output:
-                with open(args.output, 'w', encoding='utf-8') as file:
-                    json.dump(review_suggestions, file, indent=2, ensure_ascii=False)
+                with open(args.output, 'wb') as file:
+                    file.write(orjson.dumps(review_suggestions, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
                 logger.info(f"審查結果已保存到 {args.output}")
 
             # 獲取 GitHub 配置
@@ -150,21 +168,16 @@ async def main():
             logger.info("發布審查評論")
             if comment_type == 'issue' or comment_placement == 'pr':
                 # 發布 PR 級別的評論
-                github_integration.post_review_comment(args.pr, review_suggestions)
+                await github_integration.post_review_comment(args.pr, review_suggestions)
                 logger.info("已發布 PR 評論")
 
             if comment_type == 'review' or comment_placement == 'line':
                 # 發布行級評論
-                github_integration.post_line_comments(args.pr, review_suggestions)
+                await github_integration.post_line_comments(args.pr, review_suggestions, pr_node_id=pr.get('node_id'))
                 logger.info("已發布行級評論")
 
             logger.info("程式碼審查完成")
 
-        finally:
-            # 清理臨時文件
-            if os.path.exists(xml_path):
-                os.unlink(xml_path)
-
     except Exception as e:
         logger.error(f"審查過程中出錯: {e}", exc_info=True)
         sys.exit(1)
@@ -0,0 +1,114 @@
+"""
+處理 AI 回應快取的模組
+"""
+import hashlib
+import logging
+import os
+import re
+import time
+
+import orjson
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+class ResponseCache:
+
+    def __init__(self, cache_dir=None, ttl_hours=24):
+        """
+        初始化 ResponseCache
+
+        Args:
+            cache_dir (str, optional): 快取目錄，默認為 '~/.cache/ai-pr-reviewer'
+            ttl_hours (float, optional): 快取有效時間（小時），0 或以下表示停用快取
+        """
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser('~'), '.cache', 'ai-pr-reviewer')
+        self.ttl = ttl_hours * 3600
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def enabled(self):
+        """
+        快取是否啟用
+
+        Returns:
+            bool: TTL 大於 0 時為 True
+        """
+        return self.ttl > 0
+
+    def make_key(self, model, prompt, content=None):
+        """
+        根據模型和提示詞計算快取鍵
+
+        Args:
+            model (str): AI 模型
+            prompt (str): AI 提示詞中的指令和元數據部分，空白會被正規化
+            content (str, optional): 程式碼等需要逐字比對的內容，不做任何正規化
+
+        Returns:
+            str: SHA-256 十六進位快取鍵
+        """
+        # 正規化空白，避免僅有空白差異的提示詞產生不同的鍵
+        normalized = _WHITESPACE_RE.sub(' ', prompt).strip()
+        digest = hashlib.sha256(f"{model}|{normalized}".encode('utf-8'))
+
+        # 程式碼的縮排可能有意義（如 Python、YAML），必須原樣參與計算
+        if content is not None:
+            digest.update(b'\0')
+            digest.update(content.encode('utf-8'))
+
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """
+        讀取快取的回應
+
+        Args:
+            key (str): 快取鍵
+
+        Returns:
+            快取的內容，未命中或已過期時返回 None
+        """
+        if not self.enabled:
+            return None
+
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, 'rb') as file:
+                entry = orjson.loads(file.read())
+
+            if time.time() - entry['timestamp'] > entry['ttl']:
+                os.unlink(path)
+                return None
+
+            return entry['response']
+        except Exception as e:
+            self.logger.warning(f"讀取快取時出錯: {e}")
+            return None
+
+    def put(self, key, response):
+        """
+        寫入回應到快取
+
+        Args:
+            key (str): 快取鍵
+            response: 要快取的內容（AI 的原始回應或審查結果），需可序列化為 JSON
+        """
+        if not self.enabled:
+            return
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # 先寫入臨時文件再替換，避免並行執行時讀到不完整的內容
+            tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as file:
+                file.write(orjson.dumps({'timestamp': time.time(), 'ttl': self.ttl, 'response': response}))
+            os.replace(tmp_path, self._path(key))
+        except Exception as e:
+            self.logger.warning(f"寫入快取時出錯: {e}")
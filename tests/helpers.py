@@ -0,0 +1,31 @@
+"""
+測試共用的輔助函數
+"""
+import asyncio
+
+import httpx
+
+
+def run_with_mock_transport(resource, handler, coro_factory, client_owner=lambda resource: resource):
+    """
+    在 resource 的 async context 中，將其 httpx 客戶端換成 MockTransport 後執行 coro_factory
+
+    Args:
+        resource: 支援 async with 的對象，如 AIAnalyzer 或 GitHubIntegration
+        handler (callable): 接收 httpx.Request 並返回 httpx.Response 的函數
+        coro_factory (callable): 接收 resource 並返回要執行的協程
+        client_owner (callable, optional): 從 resource 取得持有 _client 屬性的對象
+
+    Returns:
+        協程的返回值
+    """
+    async def run():
+        async with resource:
+            owner = client_owner(resource)
+            original = owner._client
+            # 保留 base_url 和標頭，只替換傳輸層
+            owner._client = httpx.AsyncClient(base_url=original.base_url, headers=original.headers, transport=httpx.MockTransport(handler))
+            await original.aclose()
+            return await coro_factory(resource)
+
+    return asyncio.run(run())
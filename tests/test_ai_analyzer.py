@@ -0,0 +1,234 @@
+"""
+AIAnalyzer 的測試
+"""
+import re
+
+import httpx
+import orjson
+import pytest
+
+import src.ai_analyzer as ai_analyzer_module
+from src.ai_analyzer import MAX_RETRIES, AIAnalyzer
+from tests.helpers import run_with_mock_transport
+
+HEADER = '<file_summary>摘要</file_summary>\n<files>\n'
+TAIL = '\n</files>\n'
+
+
+def _xml(*files):
+    return HEADER + "\n".join(f'<file path="{path}">{body}</file>' for path, body in files) + TAIL
+
+
+def _anthropic_response(text, stop_reason="end_turn"):
+    return httpx.Response(200, json={"content": [{"type": "text", "text": text}], "stop_reason": stop_reason})
+
+
+def _analyze(handler, coro_factory, **kwargs):
+    kwargs.setdefault("cache_ttl_hours", 0)
+    return run_with_mock_transport(AIAnalyzer("test-key", **kwargs), handler, coro_factory)
+
+
+@pytest.fixture(autouse=True)
+def char_tokenizer(monkeypatch):
+    # 不下載 tiktoken 的 BPE 文件，以字元數估算代幣數
+    monkeypatch.setattr(ai_analyzer_module, "_load_encoding", lambda: None)
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(ai_analyzer_module.asyncio, "sleep", fake_sleep)
+    return delays
+
+
+def test_retry_honours_retry_after_then_succeeds(no_sleep):
+    responses = [httpx.Response(529, headers={"retry-after": "0.5"}), httpx.Response(429), _anthropic_response('{"summary": "ok"}')]
+
+    result = _analyze(lambda request: responses.pop(0), lambda analyzer: analyzer.analyze_code(_xml(("a.py", "x"))))
+
+    assert result == {"summary": "ok"}
+    assert no_sleep == [0.5, 2]
+
+
+def test_retry_caps_delay_and_ignores_invalid_retry_after(no_sleep):
+    responses = [httpx.Response(429, headers={"retry-after": "3600"}), httpx.Response(503, headers={"retry-after": "soon"}), _anthropic_response('{"summary": "ok"}')]
+
+    _analyze(lambda request: responses.pop(0), lambda analyzer: analyzer.analyze_code(_xml(("a.py", "x"))))
+
+    assert no_sleep == [60, 2]
+
+
+def test_retry_gives_up_after_max_attempts(no_sleep):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(500)
+
+    with pytest.raises(Exception, match="500"):
+        _analyze(handler, lambda analyzer: analyzer.analyze_code(_xml(("a.py", "x"))))
+
+    assert len(calls) == MAX_RETRIES
+    assert len(no_sleep) == MAX_RETRIES - 1
+
+
+def test_client_errors_are_not_retried(no_sleep):
+    with pytest.raises(Exception, match="400"):
+        _analyze(lambda request: httpx.Response(400), lambda analyzer: analyzer.analyze_code(_xml(("a.py", "x"))))
+
+    assert no_sleep == []
+
+
+@pytest.mark.parametrize("text, stop_reason, cached", [
+    ('{"summary": "ok"}', "end_turn", True),
+    ('{"summary": "ok"}', "max_tokens", False),
+    ("not json", "end_turn", False),
+])
+def test_response_cached_only_when_complete_and_parseable(tmp_path, text, stop_reason, cached):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return _anthropic_response(text, stop_reason)
+
+    async def analyze_twice(analyzer):
+        analyzer.cache.cache_dir = str(tmp_path)
+        await analyzer.analyze_code(_xml(("a.py", "x")))
+        await analyzer.analyze_code(_xml(("a.py", "x")))
+
+    _analyze(handler, analyze_twice, cache_ttl_hours=1)
+
+    assert len(calls) == (1 if cached else 2)
+
+
+def test_cache_key_distinguishes_indentation(tmp_path):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return _anthropic_response('{"summary": "ok"}')
+
+    async def analyze_both(analyzer):
+        analyzer.cache.cache_dir = str(tmp_path)
+        await analyzer.analyze_code(_xml(("a.py", "if x:\n    y()")))
+        await analyzer.analyze_code(_xml(("a.py", "if x:\n  y()")))
+
+    _analyze(handler, analyze_both, cache_ttl_hours=1)
+
+    assert len(calls) == 2
+
+
+def test_trim_keeps_header_and_whole_file_blocks():
+    analyzer = AIAnalyzer("test-key", cache_ttl_hours=0)
+    xml = _xml(("a.py", "x" * 100), ("b.py", "yy"))
+
+    trimmed = analyzer._trim_xml_to_budget(xml, len(HEADER) + len(TAIL) + 30)
+
+    assert trimmed.startswith(HEADER)
+    assert trimmed.endswith(TAIL)
+    assert 'path="a.py"' not in trimmed
+    assert '<file path="b.py">yy</file>' in trimmed
+
+
+def test_trim_does_not_split_on_closing_tag_inside_file_body():
+    analyzer = AIAnalyzer("test-key", cache_ttl_hours=0)
+    body = 'X = "</file>"\n' + "x" * 100
+    xml = _xml(("a.py", body), ("b.py", "yy"))
+
+    trimmed = analyzer._trim_xml_to_budget(xml, len(HEADER) + len(TAIL) + 30)
+    assert trimmed == HEADER + '\n<file path="b.py">yy</file>' + TAIL
+
+    trimmed = analyzer._trim_xml_to_budget(xml, len(HEADER) + len(TAIL) + len(body) + 30)
+    assert trimmed == HEADER + f'<file path="a.py">{body}</file>' + TAIL
+
+
+def test_trim_returns_original_when_within_budget():
+    analyzer = AIAnalyzer("test-key", cache_ttl_hours=0)
+    xml = _xml(("a.py", "x"))
+
+    assert analyzer._trim_xml_to_budget(xml, 10000) is xml
+
+
+def test_trim_hard_cuts_without_file_blocks():
+    analyzer = AIAnalyzer("test-key", cache_ttl_hours=0)
+
+    assert analyzer._trim_xml_to_budget("plain text " * 10, 5) == "plain"
+
+
+def test_trim_hard_cuts_when_header_exceeds_budget():
+    analyzer = AIAnalyzer("test-key", cache_ttl_hours=0)
+    xml = _xml(("a.py", "x"))
+
+    assert analyzer._trim_xml_to_budget(xml, 10) == xml[:10]
+
+
+def test_parse_fenced_json_with_nested_fence():
+    analyzer = AIAnalyzer("test-key", cache_ttl_hours=0)
+
+    result = analyzer._parse_ai_response('前言\n```json\n{"summary": "```py\\nx\\n```"}\n```\n')
+
+    assert result == {"summary": "```py\nx\n```"}
+
+
+def test_merge_takes_worst_assessment_and_dedupes_suggestions():
+    analyzer = AIAnalyzer("test-key", cache_ttl_hours=0)
+
+    merged = analyzer._merge_suggestions(["security", "performance"], [
+        {"summary": "s1", "overall_assessment": "需要改進", "suggestions": [{"file": "a", "line": 1, "description": "d"}]},
+        {"summary": "s2", "overall_assessment": "有重大問題", "suggestions": [{"file": "a", "line": "1", "description": "d", "category": "性能"}, {"file": "b", "description": "d"}]},
+    ])
+
+    assert merged["overall_assessment"] == "有重大問題"
+    assert merged["suggestions"] == [{"file": "a", "line": 1, "description": "d"}, {"file": "b", "description": "d"}]
+    assert "**security**: s1" in merged["summary"]
+    assert "raw_response" not in merged
+
+
+def test_merge_surfaces_partial_failure():
+    analyzer = AIAnalyzer("test-key", cache_ttl_hours=0)
+
+    merged = analyzer._merge_suggestions(["security", "performance"], [
+        {"summary": "ok", "overall_assessment": "良好", "suggestions": []},
+        analyzer._parse_ai_response("garbage"),
+    ])
+
+    assert merged["overall_assessment"] == "無法確定"
+    assert "[performance]\ngarbage" in merged["raw_response"]
+
+
+def test_non_object_json_is_treated_as_parse_failure():
+    analyzer = AIAnalyzer("test-key", cache_ttl_hours=0)
+
+    result = analyzer._parse_ai_response('["a"]')
+
+    assert result["raw_response"] == '["a"]'
+    assert "raw_response" in analyzer._merge_suggestions(["security", "performance"], [{"summary": "ok"}, result])
+
+
+def test_analyze_by_focus_warms_cache_trims_once_and_restricts_each_focus(monkeypatch):
+    focuses = []
+    trims = []
+    original_fit = AIAnalyzer._fit_xml_to_context
+
+    def counting_fit(self, xml_content, dynamic_context=""):
+        trims.append(dynamic_context)
+        return original_fit(self, xml_content, dynamic_context)
+
+    monkeypatch.setattr(AIAnalyzer, "_fit_xml_to_context", counting_fit)
+
+    def handler(request):
+        context = orjson.loads(request.content)["messages"][0]["content"][-1]["text"]
+        focus = re.search(r"只負責「(.+?)」方面", context).group(1)
+        focuses.append(focus)
+        return _anthropic_response(orjson.dumps({"summary": focus, "overall_assessment": "良好", "suggestions": [{"file": focus}]}).decode())
+
+    result = _analyze(handler, lambda analyzer: analyzer.analyze_code_by_focus(_xml(("a.py", "x")), ["security", "performance", "style"]))
+
+    assert focuses[0] == "security"
+    assert sorted(focuses) == ["performance", "security", "style"]
+    assert len(trims) == 1
+    assert [suggestion["file"] for suggestion in result["suggestions"]] == ["security", "performance", "style"]
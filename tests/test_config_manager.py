@@ -0,0 +1,65 @@
+"""
+ConfigManager 的測試
+"""
+from src.config_manager import ConfigManager
+
+
+def test_get_review_focus_prefers_pr_tags(tmp_path):
+    config_manager = ConfigManager(str(tmp_path / 'missing.yml'))
+
+    assert config_manager.get_review_focus("說明\nAI-REVIEW-FOCUS: #security #performance\n其他") == ['security', 'performance']
+    assert config_manager.get_review_focus("沒有標記") == config_manager.config['review_focus']
+
+
+def test_load_config_merges_user_file(tmp_path):
+    config_path = tmp_path / '.ai-review.yml'
+    config_path.write_text('ai:\n  model: custom-model\ngithub:\n  comment_placement: line\n', encoding='utf-8')
+
+    config_manager = ConfigManager(str(config_path))
+
+    assert config_manager.get_ai_config()['model'] == 'custom-model'
+    assert config_manager.get_ai_config()['max_tokens'] == 4000
+    assert config_manager.get_github_config() == {'comment_type': 'issue', 'comment_placement': 'line'}
+
+
+def test_create_example_config_round_trips(tmp_path):
+    config_manager = ConfigManager(str(tmp_path / 'missing.yml'))
+    output_path = str(tmp_path / 'example.yml')
+
+    config_manager.create_example_config(output_path)
+
+    assert ConfigManager(output_path).get_ai_config()['model'] == 'claude-3-haiku-20240307'
+
+
+def test_merge_configs_deep_merges_without_mutating_defaults():
+    config_manager = ConfigManager.__new__(ConfigManager)
+    default_config = {'ai': {'model': 'm', 'options': {'a': 1, 'b': 2}}, 'review_focus': ['x']}
+
+    merged = config_manager._merge_configs(default_config, {'ai': {'options': {'b': 3, 'c': 4}}, 'review_focus': ['y'], 'extra': {'k': 'v'}})
+
+    assert merged == {'ai': {'model': 'm', 'options': {'a': 1, 'b': 3, 'c': 4}}, 'review_focus': ['y'], 'extra': {'k': 'v'}}
+    assert default_config == {'ai': {'model': 'm', 'options': {'a': 1, 'b': 2}}, 'review_focus': ['x']}
+
+
+def test_merge_configs_replaces_non_dict_with_dict_and_vice_versa():
+    config_manager = ConfigManager.__new__(ConfigManager)
+
+    merged = config_manager._merge_configs({'a': 1, 'b': {'c': 2}}, {'a': {'x': 1}, 'b': None})
+
+    assert merged == {'a': {'x': 1}, 'b': None}
+
+
+def test_merge_configs_handles_trees_deeper_than_the_recursion_limit():
+    config_manager = ConfigManager.__new__(ConfigManager)
+    default_config = {}
+    user_config = leaf = {}
+    for _ in range(5000):
+        leaf['n'] = {}
+        leaf = leaf['n']
+    leaf['value'] = 1
+
+    merged = config_manager._merge_configs(default_config, user_config)
+
+    for _ in range(5000):
+        merged = merged['n']
+    assert merged == {'value': 1}
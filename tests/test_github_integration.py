@@ -0,0 +1,108 @@
+"""
+GitHubIntegration 的測試
+"""
+import httpx
+import orjson
+import pytest
+
+from src.github_integration import GitHubIntegration
+from tests.helpers import run_with_mock_transport
+
+
+def _call(handler, coro_factory):
+    return run_with_mock_transport(GitHubIntegration("test-token", "owner/repo"), handler, coro_factory, client_owner=lambda github_integration: github_integration.client)
+
+
+def test_get_pr_files_follows_link_pagination():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.url.params.get("page") == "2":
+            return httpx.Response(200, json=[{"filename": "b.py"}])
+        return httpx.Response(200,
+                              json=[{"filename": "a.py"}],
+                              headers={"Link": '<https://api.github.com/repos/owner/repo/pulls/1/files?per_page=100&page=2>; rel="next"'})
+
+    files = _call(handler, lambda github_integration: github_integration.get_pr_files(1))
+
+    assert files == ["a.py", "b.py"]
+    assert requests[0].url.path == "/repos/owner/repo/pulls/1/files"
+    assert requests[0].url.params["per_page"] == "100"
+    assert requests[0].headers["authorization"] == "Bearer test-token"
+    assert len(requests) == 2
+
+
+def test_api_errors_raise():
+    with pytest.raises(Exception, match="404"):
+        _call(lambda request: httpx.Response(404, json={}), lambda github_integration: github_integration.get_pr(1))
+
+
+def test_post_line_comments_merges_and_sorts_by_location():
+    sent = []
+
+    def handler(request):
+        sent.append(orjson.loads(request.content))
+        return httpx.Response(200, json={"data": {"addPullRequestReview": {"pullRequestReview": {"id": "R_1", "url": "https://example.com"}}}})
+
+    suggestions = {
+        "summary": "總結",
+        "overall_assessment": "需要改進",
+        "suggestions": [
+            {"file": "b.py", "line": "3-5", "category": "安全性", "severity": "high", "description": "d1"},
+            {"file": "a.py", "line": 10, "description": "d2", "suggestion": "s2"},
+            {"file": "b.py", "line": "3", "category": "性能", "severity": "low", "description": "d3"},
+            {"file": "b.py", "line": 3, "category": "性能", "severity": "low", "description": "d3"},
+            {"file": "c.py", "line": "n/a", "description": "ignored"},
+            {"description": "no location"},
+        ],
+    }
+
+    _call(handler, lambda github_integration: github_integration.post_line_comments(1, suggestions, pr_node_id="PR_1"))
+
+    threads = sent[0]["variables"]["input"]["threads"]
+    assert [(thread["path"], thread["line"]) for thread in threads] == [("a.py", 10), ("b.py", 3)]
+    assert threads[0]["body"] == "**評論 (提示)**\n\nd2\n\n**建議**: s2"
+    assert threads[1]["body"] == "**安全性 (high)**\n\nd1\n\n---\n\n**性能 (low)**\n\nd3"
+
+
+def test_post_line_comments_without_line_suggestions_sends_nothing():
+    def handler(request):
+        raise AssertionError("不應發送請求")
+
+    assert _call(handler, lambda github_integration: github_integration.post_line_comments(1, {"suggestions": [{"description": "x"}]})) is None
+
+
+def test_post_line_comments_sends_add_review_mutation():
+    sent = []
+
+    def handler(request):
+        sent.append(request)
+        return httpx.Response(200, json={"data": {"addPullRequestReview": {"pullRequestReview": {"id": "R_1", "url": "https://example.com"}}}})
+
+    review = _call(handler, lambda github_integration: github_integration.post_line_comments(1, {"summary": "總結", "suggestions": [{"file": "a.py", "line": 1, "description": "d"}]}, pr_node_id="PR_1"))
+
+    assert review == {"id": "R_1", "url": "https://example.com"}
+    assert sent[0].url.path == "/graphql"
+    payload = orjson.loads(sent[0].content)
+    assert "addPullRequestReview" in payload["query"]
+    assert payload["variables"]["input"]["pullRequestId"] == "PR_1"
+    assert payload["variables"]["input"]["threads"][0]["side"] == "RIGHT"
+
+
+def test_post_line_comments_fetches_node_id_when_missing():
+    def handler(request):
+        if request.method == "GET":
+            return httpx.Response(200, json={"node_id": "PR_2"})
+        assert orjson.loads(request.content)["variables"]["input"]["pullRequestId"] == "PR_2"
+        return httpx.Response(200, json={"data": {"addPullRequestReview": {"pullRequestReview": {"id": "R_2", "url": "u"}}}})
+
+    review = _call(handler, lambda github_integration: github_integration.post_line_comments(1, {"suggestions": [{"file": "a.py", "line": 1}]}))
+
+    assert review["id"] == "R_2"
+
+
+def test_post_line_comments_raises_on_graphql_errors():
+    with pytest.raises(Exception, match="bad input"):
+        _call(lambda request: httpx.Response(200, json={"errors": [{"message": "bad input"}]}),
+              lambda github_integration: github_integration.post_line_comments(1, {"suggestions": [{"file": "a.py", "line": 1}]}, pr_node_id="PR_1"))
@@ -0,0 +1,49 @@
+"""
+RepomixHandler 的測試
+"""
+import asyncio
+import os
+import time
+
+import pytest
+
+from src.repomix_handler import RepomixHandler
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+
+    # 已結束但尚未被回收的殭屍進程不算在執行
+    try:
+        with open(f'/proc/{pid}/stat') as file:
+            return file.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except OSError:
+        return True
+
+
+@pytest.mark.skipif(not hasattr(os, 'killpg'), reason="需要 POSIX 進程組")
+def test_cancel_kills_repomix_child_processes(tmp_path, monkeypatch):
+    pid_file = tmp_path / 'child.pid'
+    repomix_handler = RepomixHandler(str(tmp_path))
+    # 模擬 npx 再啟動 repomix 子進程的情況
+    monkeypatch.setattr(repomix_handler, '_build_command', lambda include_patterns=None, exclude_patterns=None: ['sh', '-c', f'sleep 30 & echo $! > {pid_file}; wait'])
+
+    async def generate_then_cancel():
+        task = asyncio.create_task(repomix_handler.generate_xml())
+        while not pid_file.exists() or not pid_file.read_text().strip():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # 子進程被結束後由 init 回收，稍等片刻再確認
+        child_pid = int(pid_file.read_text())
+        deadline = time.monotonic() + 5
+        while _is_running(child_pid) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        assert not _is_running(child_pid)
+
+    asyncio.run(asyncio.wait_for(generate_then_cancel(), timeout=10))
@@ -0,0 +1,45 @@
+"""
+ResponseCache 的測試
+"""
+import time
+
+from src.response_cache import ResponseCache
+
+
+def test_put_and_get_round_trip(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl_hours=1)
+    key = cache.make_key('model', 'prompt')
+
+    cache.put(key, {'summary': '總結'})
+
+    assert cache.get(key) == {'summary': '總結'}
+
+
+def test_expired_entries_are_dropped(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path), ttl_hours=1)
+    key = cache.make_key('model', 'prompt')
+    cache.put(key, 'response')
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 2 * 3600)
+
+    assert cache.get(key) is None
+    assert not (tmp_path / f"{key}.json").exists()
+
+
+def test_zero_ttl_disables_cache(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl_hours=0)
+    key = cache.make_key('model', 'prompt')
+
+    cache.put(key, 'response')
+
+    assert cache.get(key) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_make_key_normalises_prompt_but_not_content():
+    cache = ResponseCache(ttl_hours=1)
+
+    assert cache.make_key('model', 'a  b\n') == cache.make_key('model', 'a b')
+    assert cache.make_key('model', 'p', content='x\n    y') != cache.make_key('model', 'p', content='x\n  y')
+    assert cache.make_key('model-a', 'p') != cache.make_key('model-b', 'p')